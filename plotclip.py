@@ -3,14 +3,18 @@
 """
 
 import argparse
+import concurrent.futures
 import datetime
+import functools
 import json
 import logging
+import math
 import os
-import subprocess
+import struct
 import tempfile
 from typing import Optional
 import numpy as np
+import orjson
 from agpypeline import algorithm, entrypoint, geometries, geoimage, lasfile
 from agpypeline.environment import Environment
 from agpypeline.checkmd import CheckMD
@@ -72,6 +76,65 @@ class __internal__:
 
         return return_sr
 
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def get_coordinate_transformation(source_wkt: str, target_wkt: str, target_axis_strategy: int) -> \
+            osr.CoordinateTransformation:
+        """Returns a coordinate transformation between the two spatial references. Transformations are cached
+           so that repeated conversions between the same coordinate systems don't rebuild the PROJ pipeline
+        Arguments:
+            source_wkt: the WKT of the source spatial reference
+            target_wkt: the WKT of the target spatial reference
+            target_axis_strategy: the axis mapping strategy of the target spatial reference
+        Return:
+            The coordinate transformation
+        Exceptions:
+            Raises RuntimeError if a spatial reference can't be loaded
+        Notes:
+            As with geometries.convert_geometry(), the source uses the traditional GIS axis order (GDAL 3 changes
+            axis order: https://github.com/OSGeo/gdal/issues/1546)
+        """
+        source_sr = osr.SpatialReference()
+        if source_sr.ImportFromWkt(source_wkt) != ogr.OGRERR_NONE:
+            raise RuntimeError('Unable to load source spatial reference "%s"' % source_wkt)
+        source_sr.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        target_sr = osr.SpatialReference()
+        if target_sr.ImportFromWkt(target_wkt) != ogr.OGRERR_NONE:
+            raise RuntimeError('Unable to load target spatial reference "%s"' % target_wkt)
+        target_sr.SetAxisMappingStrategy(target_axis_strategy)
+
+        return osr.CoordinateTransformation(source_sr, target_sr)
+
+    @staticmethod
+    def convert_geometry(geometry: ogr.Geometry, new_spatialreference: osr.SpatialReference) -> ogr.Geometry:
+        """Converts the geometry to the new spatial reference if possible, using a cached coordinate transformation
+        Arguments:
+            geometry: the geometry to convert
+            new_spatialreference: the spatial reference to convert to
+        Return:
+            The converted geometry or the original geometry if it doesn't need converting or can't be converted
+        """
+        if not geometry or not new_spatialreference:
+            return geometry
+        geom_sr = geometry.GetSpatialReference()
+        if not geom_sr or new_spatialreference.IsSame(geom_sr):
+            return geometry
+
+        try:
+            transform = __internal__.get_coordinate_transformation(geom_sr.ExportToWkt(),
+                                                                   new_spatialreference.ExportToWkt(),
+                                                                   new_spatialreference.GetAxisMappingStrategy())
+            new_geom = geometry.Clone()
+            if new_geom and new_geom.Transform(transform) == ogr.OGRERR_NONE:
+                new_geom.AssignSpatialReference(new_spatialreference)
+                return new_geom
+        except Exception as ex:
+            logging.warning("Exception caught while converting geometry with cached transformation: %s", str(ex))
+
+        # Fall back to the uncached conversion
+        return geometries.convert_geometry(geometry, new_spatialreference)
+
     @staticmethod
     def get_geojson_file_sr(geojson: dict) -> Optional[osr.SpatialReference]:
         """Returns the spatial reference loaded from the GeoJSON
@@ -125,11 +188,12 @@ class __internal__:
             return 'observationUnitName', properties['observationUnitName']
 
         best_fit = None
-        for one_key in properties:
-            if (one_key.lower().find('plot') >= 0) and ((one_key.lower().find('name') >= 0) or one_key.lower().find('id') >= 0):
+        lower_keys = [(one_key, one_key.lower()) for one_key in properties]
+        for one_key, lower_key in lower_keys:
+            if 'plot' in lower_key and ('name' in lower_key or 'id' in lower_key):
                 logging.debug('[get_plot_key_name]  1 best fit "%s"', one_key)
                 best_fit = one_key
-            elif one_key.lower() == 'id' and not best_fit:
+            elif lower_key == 'id' and not best_fit:
                 logging.debug('[get_plot_key_name]  2 best fit "%s"', one_key)
                 best_fit = one_key
 
@@ -141,13 +205,132 @@ class __internal__:
             logging.debug('[get_plot_key_name] id: "%s"', properties['id'])
             return 'id', properties['id']
 
-        for one_key in properties:
-            if one_key.lower().find('id') >= 0:
+        for one_key, lower_key in lower_keys:
+            if 'id' in lower_key:
                 logging.debug('[get_plot_key_name]  ID best fit "%s"', one_key)
                 return one_key, properties[one_key]
 
         return None
 
+    @staticmethod
+    def is_numeric_point(point: list, dimensions: int) -> bool:
+        """Checks that a GeoJSON point has the expected number of dimensions and only contains numbers
+        Arguments:
+            point: the GeoJSON coordinates of the point
+            dimensions: the expected number of dimensions
+        Return:
+            Returns True if the point is usable, and False otherwise
+        Notes:
+            The value types are checked directly since numpy quietly converts booleans to numbers. Values such as
+            null, strings, or booleans are left for OGR to reject
+        """
+        return isinstance(point, list) and len(point) == dimensions and \
+            all(type(value) in (int, float) for value in point)
+
+    @staticmethod
+    def geojson_to_wkb(geojson_geometry: dict, dimensions: int = None) -> Optional[bytes]:
+        """Packs the coordinates of a GeoJSON geometry directly into little-endian WKB
+        Arguments:
+            geojson_geometry: the GeoJSON geometry to pack
+            dimensions: the number of dimensions of each point (2 or 3); determined from the coordinates if not specified
+        Return:
+            Returns the WKB of the geometry or None if the geometry type isn't supported, or the coordinates are
+            not consistent or not all numbers that fit in a double
+        Notes:
+            Point, LineString, Polygon, MultiPoint, MultiLineString, and MultiPolygon geometries are supported
+        """
+        # pylint: disable=too-many-return-statements, too-many-branches
+        wkb_25d_flag = 0x80000000
+        wkb_types = {
+            'Point': (ogr.wkbPoint, None),
+            'LineString': (ogr.wkbLineString, None),
+            'Polygon': (ogr.wkbPolygon, None),
+            'MultiPoint': (ogr.wkbMultiPoint, 'Point'),
+            'MultiLineString': (ogr.wkbMultiLineString, 'LineString'),
+            'MultiPolygon': (ogr.wkbMultiPolygon, 'Polygon')
+        }
+        if not isinstance(geojson_geometry, dict) or geojson_geometry.get('type') not in wkb_types:
+            return None
+        coordinates = geojson_geometry.get('coordinates')
+        if not isinstance(coordinates, list) or not coordinates:
+            return None
+
+        # Find the point dimensions from the first coordinate
+        if dimensions is None:
+            first_point = coordinates
+            while isinstance(first_point, list) and first_point and isinstance(first_point[0], list):
+                first_point = first_point[0]
+            dimensions = len(first_point) if isinstance(first_point, list) else 0
+        if dimensions not in (2, 3):
+            return None
+
+        wkb_type, member_type = wkb_types[geojson_geometry['type']]
+        if dimensions == 3:
+            wkb_type |= wkb_25d_flag
+        wkb = struct.pack('<BI', 1, wkb_type)
+
+        try:
+            if member_type:
+                members = [__internal__.geojson_to_wkb({'type': member_type, 'coordinates': one_member}, dimensions)
+                           for one_member in coordinates]
+                if not all(members):
+                    return None
+                return wkb + struct.pack('<I', len(members)) + b''.join(members)
+
+            if geojson_geometry['type'] == 'Point':
+                if not __internal__.is_numeric_point(coordinates, dimensions):
+                    return None
+                return wkb + np.array(coordinates, dtype='<f8').tobytes()
+
+            rings = [coordinates] if geojson_geometry['type'] == 'LineString' else coordinates
+            if geojson_geometry['type'] == 'Polygon':
+                wkb += struct.pack('<I', len(rings))
+            for one_ring in rings:
+                if not one_ring or \
+                        not all(__internal__.is_numeric_point(one_point, dimensions) for one_point in one_ring):
+                    return None
+                points = np.array(one_ring, dtype='<f8').reshape((-1, dimensions))
+                wkb += struct.pack('<I', points.shape[0]) + points.tobytes()
+        except (OverflowError, TypeError, ValueError):
+            return None
+
+        return wkb
+
+    @staticmethod
+    def create_geometry(geojson_geometry: dict) -> Optional[ogr.Geometry]:
+        """Creates a geometry from a GeoJSON geometry
+        Arguments:
+            geojson_geometry: the GeoJSON geometry to convert
+        Return:
+            The created geometry or None if it couldn't be created
+        Notes:
+            Geometries are packed into WKB when possible, and only converted through JSON when not
+        """
+        geometry_wkb = __internal__.geojson_to_wkb(geojson_geometry)
+        if geometry_wkb:
+            return ogr.CreateGeometryFromWkb(geometry_wkb)
+        return ogr.CreateGeometryFromJson(json.dumps(geojson_geometry))
+
+    @staticmethod
+    def parse_json(json_contents: bytes) -> Optional[dict]:
+        """Parses JSON with orjson, falling back to the json module for JSON that orjson rejects
+        Arguments:
+            json_contents: the JSON to parse
+        Return:
+            Returns the parsed JSON, or None if it's not valid JSON
+        Notes:
+            orjson rejects some JSON the json module accepts, such as NaN and integers wider than 64 bits
+        """
+        try:
+            return orjson.loads(json_contents)
+        except orjson.JSONDecodeError:
+            pass
+
+        try:
+            return json.loads(json_contents)
+        except json.JSONDecodeError:
+            return None
+
     @staticmethod
     def load_plot_file(plot_file: str, plot_column: str = None) -> dict:
         """Loads the GeoJSON plot file and returns a dict with plot names and geometries as key, value pairs
@@ -163,12 +346,8 @@ class __internal__:
         plots = {}
 
         # Load the file contents and check them
-        with open(plot_file, 'r') as in_file:
-            geojson = None
-            try:
-                geojson = json.load(in_file)
-            except json.JSONDecodeError:
-                pass
+        with open(plot_file, 'rb') as in_file:
+            geojson = __internal__.parse_json(in_file.read())
             if not geojson:
                 raise RuntimeError('No JSON was found in file: "%s"' % plot_file)
             for req_key in ['type', 'features']:
@@ -200,12 +379,17 @@ class __internal__:
                 logging.info('Skipping unknown feature at index %s: "%s"', str(feature_idx), str(plot_file))
                 continue
             if 'properties' in one_feature and one_feature['properties']:
-                plot_key, plot_name = __internal__.get_plot_key_name(one_feature['properties'], plot_key)
+                properties = one_feature['properties']
+                # Features usually share a schema so we use the key directly instead of searching
+                found_key = (plot_key, properties[plot_key]) if plot_key and plot_key in properties else \
+                    __internal__.get_plot_key_name(properties, plot_key)
+                if found_key:
+                    plot_key, plot_name = found_key
             if not plot_name:
                 plot_name = 'Plot ' + str(feature_idx)
 
             # Create the geometry
-            plot_geom = ogr.CreateGeometryFromJson(json.dumps(one_feature['geometry']))
+            plot_geom = __internal__.create_geometry(one_feature['geometry'])
             if not plot_geom:
                 raise RuntimeError('Unable to create geometry from JSON at index %s: "%s"' % (str(feature_idx), plot_file))
 
@@ -221,36 +405,64 @@ class __internal__:
         return plots
 
     @staticmethod
-    def find_plots_intersect_boundingbox(bounding_box: ogr.Geometry, all_plots: dict) -> dict:
+    def build_plots_index(all_plots: dict, index_sr: Optional[osr.SpatialReference]) -> dict:
+        """Builds an envelope index of the plots in the specified spatial reference
+        Arguments:
+            all_plots: the dictionary of all available plots
+            index_sr: the spatial reference to convert the plots to; if None the plots aren't converted
+        Return:
+            A dictionary with the plot names, the plot geometries converted to the spatial reference,
+            and an array of plot envelopes (min X, max X, min Y, max Y) in the same order
+        """
+        names = []
+        index_geometries = []
+        envelopes = []
+        for plot_name in all_plots:
+            check_poly = all_plots[plot_name]
+            if index_sr:
+                check_poly = __internal__.convert_geometry(check_poly, index_sr)
+
+            names.append(plot_name)
+            index_geometries.append(check_poly)
+            envelopes.append(check_poly.GetEnvelope())
+
+        return {
+            'names': names,
+            'geometries': index_geometries,
+            'envelopes': np.array(envelopes, dtype=np.float64).reshape((-1, 4))
+        }
+
+    @staticmethod
+    def find_plots_intersect_boundingbox(bounding_box: ogr.Geometry, all_plots: dict, plots_index: dict = None) -> dict:
         """Take a list of plots and return only those overlapping bounding box.
         Arguments:
             bounding_box: the geometry of the bounding box
             all_plots: the dictionary of all available plots
+            plots_index: optional index of the plots in the bounding box spatial reference (see build_plots_index);
+                    one is built if not specified
         Return:
-            A dictionary of all intersecting plots
+            A dictionary of all intersecting plots with their geometries in the bounding box spatial reference
         """
         bb_sr = bounding_box.GetSpatialReference()
+        bb_min_x, bb_max_x, bb_min_y, bb_max_y = bounding_box.GetEnvelope()
         intersecting_plots = {}
         logging.debug("[find_plots_intersect_boundingbox] Bounding box %s %s", str(bb_sr), str(bounding_box))
 
-        for plot_name in all_plots:
-            current_poly = all_plots[plot_name]
+        if plots_index is None:
+            plots_index = __internal__.build_plots_index(all_plots, bb_sr)
 
-            # Check for a need to convert coordinate systems
-            check_poly = current_poly
-            if bb_sr:
-                poly_sr = current_poly.GetSpatialReference()
-                if poly_sr and not bb_sr.IsSame(poly_sr):
-                    # We need to convert to the same coordinate system before an intersection
-                    check_poly = geometries.convert_geometry(current_poly, bb_sr)
+        # Only check the plots whose envelopes overlap the bounding box
+        envelopes = plots_index['envelopes']
+        candidates = np.flatnonzero((envelopes[:, 1] >= bb_min_x) & (envelopes[:, 0] <= bb_max_x) &
+                                    (envelopes[:, 3] >= bb_min_y) & (envelopes[:, 2] <= bb_max_y))
 
-            logging.debug("[find_plots_intersect_boundingbox] Intersection with %s", str(check_poly))
-            intersection_with_bounding_box = bounding_box.Intersection(check_poly)
+        for plot_idx in candidates:
+            plot_name = plots_index['names'][plot_idx]
+            check_poly = plots_index['geometries'][plot_idx]
 
-            if intersection_with_bounding_box is not None:
-                intersection = json.loads(intersection_with_bounding_box.ExportToJson())
-                if 'coordinates' in intersection and len(intersection['coordinates']) > 0:
-                    intersecting_plots[str(plot_name)] = current_poly
+            logging.debug("[find_plots_intersect_boundingbox] Intersection with %s", str(check_poly))
+            if bounding_box.Intersects(check_poly):
+                intersecting_plots[str(plot_name)] = check_poly
 
         return intersecting_plots
 
@@ -264,27 +476,73 @@ class __internal__:
             Returns a dictionary with the file names as keys. Each key's value is another dictionary containing
             the file path and the file bounds (as ogr.Geometry)
         """
+        # The functions for loading the bounds of each supported file type
+        bounds_loaders = {
+            '.tif': geoimage.get_image_bounds,
+            '.las': lasfile.get_las_extents
+        }
+
+        # List each folder once to find the existing files, instead of checking each file individually. Folders
+        # that can't be listed (for example, when only execute permission is granted) are set to None and their
+        # files are checked individually
+        folder_files = {}
+        for one_folder in {os.path.dirname(one_file) for one_file in file_list}:
+            try:
+                with os.scandir(one_folder if one_folder else '.') as folder_entries:
+                    folder_files[one_folder] = {one_entry.name for one_entry in folder_entries}
+            except OSError:
+                folder_files[one_folder] = None
+
         files_to_process = {}
         for one_file in file_list:
             filename = os.path.basename(one_file)
             if filename in files_to_process:
                 continue
-            if not os.path.exists(one_file):
+            known_files = folder_files[os.path.dirname(one_file)]
+            if known_files is None:
+                file_exists = os.path.exists(one_file)
+            else:
+                file_exists = filename in known_files
+            if not file_exists:
                 logging.warning("Skipping file that does not exist: '%s'", one_file)
                 continue
 
-            if one_file.endswith('.tif'):
-                files_to_process[filename] = {
-                    'path': one_file,
-                    'bounds': geoimage.get_image_bounds(one_file, default_epsg)
-                }
-            elif one_file.endswith(".las"):
+            bounds_loader = bounds_loaders.get(os.path.splitext(filename)[1])
+            if bounds_loader:
                 files_to_process[filename] = {
                     'path': one_file,
-                    'bounds': lasfile.get_las_extents(one_file, default_epsg)
+                    'bounds': bounds_loader(one_file, default_epsg)
                 }
         return files_to_process
 
+    @staticmethod
+    def is_axis_aligned_rectangle(geometry: ogr.Geometry) -> bool:
+        """Checks if the geometry is a rectangle with its sides aligned to the coordinate axes
+        Arguments:
+            geometry: the geometry to check
+        Return:
+            Returns True if the geometry is a single ring polygon with its corners on its envelope, and False otherwise
+        """
+        if not geometry or ogr.GT_Flatten(geometry.GetGeometryType()) != ogr.wkbPolygon or \
+                geometry.GetGeometryCount() != 1:
+            return False
+
+        ring = geometry.GetGeometryRef(0)
+        if ring.GetPointCount() != 5 or ring.GetPoint_2D(0) != ring.GetPoint_2D(4):
+            return False
+
+        min_x, max_x, min_y, max_y = geometry.GetEnvelope()
+        envelope_area = (max_x - min_x) * (max_y - min_y)
+        if envelope_area <= 0:
+            return False
+        for idx in range(0, 4):
+            point_x, point_y = ring.GetPoint_2D(idx)
+            if point_x not in (min_x, max_x) or point_y not in (min_y, max_y):
+                return False
+
+        # Corners in the wrong order have a smaller area than the envelope
+        return math.isclose(geometry.Area(), envelope_area)
+
     @staticmethod
     def calculate_overlap_percent(check_bounds: ogr.Geometry, other_bounds: ogr.Geometry) -> float:
         """Calculates and returns the percentage overlap between the two boundaries.
@@ -297,11 +555,29 @@ class __internal__:
         Return:
             The calculated overlap percent (0.0 - 1.0) or 0.0 if there is no overlap.
             If an exception is detected, a warning message is logged and 0.0 is returned.
+        Notes:
+            When the other bounds are an axis aligned rectangle, the overlap is calculated from the envelopes
+            if check_bounds is entirely within it or is also an axis aligned rectangle
         """
         try:
             if check_bounds and other_bounds:
+                if __internal__.is_axis_aligned_rectangle(other_bounds):
+                    check_min_x, check_max_x, check_min_y, check_max_y = check_bounds.GetEnvelope()
+                    other_min_x, other_max_x, other_min_y, other_max_y = other_bounds.GetEnvelope()
+                    if check_min_x >= other_min_x and check_max_x <= other_max_x and \
+                            check_min_y >= other_min_y and check_max_y <= other_max_y:
+                        return 1.0 if check_bounds.Area() > 0 else 0.0
+
+                    if __internal__.is_axis_aligned_rectangle(check_bounds):
+                        overlap_width = min(check_max_x, other_max_x) - max(check_min_x, other_min_x)
+                        overlap_height = min(check_max_y, other_max_y) - max(check_min_y, other_min_y)
+                        if overlap_width <= 0 or overlap_height <= 0:
+                            return 0.0
+                        return (overlap_width * overlap_height) / \
+                            ((check_max_x - check_min_x) * (check_max_y - check_min_y))
+
                 intersection = other_bounds.Intersection(check_bounds)
-                if intersection:
+                if intersection and not intersection.IsEmpty():
                     return intersection.Area() / check_bounds.Area()
         except Exception as ex:
             logging.warning("Exception caught while calculating shape overlap: %s", str(ex))
@@ -331,18 +607,24 @@ class __internal__:
         return new_md
 
     @staticmethod
-    def prepare_container_md(plot_name: str, plot_md: dict, source_file: str, result_files: list) -> dict:
+    def prepare_container_md(plot_name: str, plot_md: dict, source_file: str, result_files: list,
+                             *, check_exists: bool = True, timestamp: str = None) -> dict:
         """Prepares the metadata for a single container
         Arguments:
             plot_name: the name of the container
             plot_md: the metadata associated with this container
             source_file: the name of the source file
             result_files: list of files to add to container metadata
+            check_exists: set to False if the caller has already checked that the result files exist
+            timestamp: the ISO formatted timestamp to add to the file metadata; the current UTC time is used if
+                    not specified
         Return:
             The formatted metadata
         Notes:
-            The files in result_files are checked for existence before being added to the metadata
+            Unless check_exists is False, the files in result_files are checked for existence before being
+            added to the metadata
         """
+        # pylint: disable=too-many-arguments
         cur_md = {
             'name': plot_name,
             'metadata': {
@@ -351,65 +633,68 @@ class __internal__:
             },
             'file': []
         }
+        if not timestamp:
+            timestamp = datetime.datetime.utcnow().isoformat()
         for one_file in result_files:
-            if os.path.exists(one_file):
+            if not check_exists or os.path.exists(one_file):
                 cur_md['file'].append({
                     'path': one_file,
                     'metadata': {
                         'source': source_file,
                         'transformer': ConfigurationPlotclip.transformer_name,
                         'version': ConfigurationPlotclip.transformer_version,
-                        'timestamp': datetime.datetime.utcnow().isoformat(),
+                        'timestamp': timestamp,
                         'plot_name': plot_name
                     }
                 })
         return cur_md
 
     @staticmethod
-    def merge_container_md(dest_md: list, new_md: dict) -> list:
+    def merge_container_md(dest_md: list, new_md: dict, md_index: dict = None) -> list:
         """Merges container level metadata ensuring there aren't any plot-level
            duplicates or duplicate file entries for a plot entry
         Arguments:
             dest_md: the list of current metadata to merge into
             new_md: the new metadata to merge
+            md_index: optional dictionary of container names and their index in dest_md that's updated as
+                    metadata is added; if not specified dest_md is searched for a matching container
         Return:
             Returns a new list of metadata with the new metadata merged into it
         """
         # Return something meaningful if we have missing or empty dict
         if not dest_md:
             if new_md:
+                if md_index is not None:
+                    md_index[new_md['name']] = 0
                 return [new_md]
             return []
 
-        # Copy the metadata and look for a match
-        match_idx = -1
-        md_len = len(dest_md)
-        for idx in range(0, md_len):
-            if dest_md[idx]['name'] == new_md['name']:
-                match_idx = idx
-                break
+        # Look for a match
+        if md_index is not None:
+            match_idx = md_index.get(new_md['name'], -1)
+        else:
+            match_idx = next((idx for idx, one_md in enumerate(dest_md) if one_md['name'] == new_md['name']), -1)
 
         # If no match found, add and return
         if match_idx == -1:
+            if md_index is not None:
+                md_index[new_md['name']] = len(dest_md)
             dest_md.append(new_md)
             return dest_md
 
         # Merge the metadata
         working_md = dest_md[match_idx]
-        if 'files' in new_md:
-            if 'files' in working_md:
+        if 'file' in new_md:
+            if 'file' in working_md:
                 # Only add files that aren't included in the destination metadata already
-                for one_file in new_md['files']:
-                    file_match_found = False
-                    for match_file in working_md['files']:
-                        if one_file['path'] == match_file['path']:
-                            file_match_found = True
-                            break
-                    if not file_match_found:
-                        dest_md[match_idx]['files'].append(one_file)
+                known_paths = {one_file['path'] for one_file in working_md['file']}
+                for one_file in new_md['file']:
+                    if one_file['path'] not in known_paths:
+                        working_md['file'].append(one_file)
+                        known_paths.add(one_file['path'])
             else:
-                # Target metadata doesn't have a 'files' entry
-                dest_md[match_idx]['files'] = new_md['files']
+                # Target metadata doesn't have a 'file' entry
+                working_md['file'] = new_md['file']
 
         return dest_md
 
@@ -446,24 +731,60 @@ class __internal__:
             Returns the destination file pixels upon success and None otherwise
         """
         # Write the clipline to the CSV file
-        _, cutline_csv = tempfile.mkstemp(suffix=".csv")
+        cutline_fd, cutline_csv = tempfile.mkstemp(suffix=".csv")
         logging.debug("clip_to_cutline: CSV %s", cutline_csv)
-        with open(cutline_csv, 'w') as out_file:
+        with os.fdopen(cutline_fd, 'w') as out_file:
             logging.debug("clip_to_cutline: WKT %s", clip_bounds.ExportToWkt())
             out_file.write('id,WKT\n')
             out_file.write(','.join(['1, "%s"' % clip_bounds.ExportToWkt()]))
 
         # Clip to the cutline
-        cmd = 'gdalwarp -crop_to_cutline -dstalpha -overwrite -cutline %s "%s" "%s"' % (cutline_csv, source_file, dest_file)
-        logging.debug("clip_to_cutline: CMD: '%s'", cmd)
-        subprocess.call(cmd, shell=True, stdout=open(os.devnull, 'wb'))
-        out_px = np.array(gdal.Open(dest_file).ReadAsArray())
-        if np.count_nonzero(out_px) > 0:
-            return out_px
-
-        os.remove(dest_file)
+        logging.debug("clip_to_cutline: warping '%s' to '%s'", source_file, dest_file)
+        warp_ds = gdal.Warp(dest_file, source_file, cutlineDSName=cutline_csv, cropToCutline=True, dstAlpha=True)
+        os.unlink(cutline_csv)
+        if warp_ds is not None:
+            out_px = np.array(warp_ds.ReadAsArray())
+            # Close the dataset so that it's written out
+            warp_ds = None
+            if np.count_nonzero(out_px) > 0:
+                return out_px
+
+        if os.path.exists(dest_file):
+            os.remove(dest_file)
         return None
 
+    @staticmethod
+    def clip_raster_rectangle(file_source: str, file_bounds: ogr.Geometry, clip_bounds: ogr.Geometry,
+                              out_file: str) -> Optional[int]:
+        """Clips the raster to the intersection of the file bounds and clip bounds when both are axis aligned rectangles
+        Arguments:
+            file_source: the path to the source file
+            file_bounds: the geometric boundary of the source file
+            clip_bounds: the geometric boundary to clip to
+            out_file: the path to store the clipped image
+        Return:
+            The number of pixels in the new image, or None if no pixels were saved
+        Notes:
+            Assumes the boundaries are in the same coordinate system. The clipped image matches what
+            geoimage.clip_raster_intersection() produces, without running gdal_translate in a separate process
+        """
+        file_min_x, file_max_x, file_min_y, file_max_y = file_bounds.GetEnvelope()
+        clip_min_x, clip_max_x, clip_min_y, clip_max_y = clip_bounds.GetEnvelope()
+        min_x, max_x = max(file_min_x, clip_min_x), min(file_max_x, clip_max_x)
+        min_y, max_y = max(file_min_y, clip_min_y), min(file_max_y, clip_max_y)
+        if min_x >= max_x or min_y >= max_y:
+            logging.info("File does not intersect plot boundary: %s", file_source)
+            return None
+
+        out_ds = gdal.Translate(out_file, file_source, projWin=[min_x, max_y, max_x, min_y])
+        if out_ds is None:
+            return None
+        pixel_count = out_ds.RasterXSize * out_ds.RasterYSize
+        # Close the dataset so that it's written out
+        out_ds = None
+
+        return pixel_count if pixel_count > 0 else None
+
     @staticmethod
     def clip_tiff(file_source: str, file_bounds: ogr.Geometry, clip_bounds: ogr.Geometry, out_file: str,
                   fill_plot: bool = False) -> None:
@@ -477,13 +798,16 @@ class __internal__:
                     intersection between the image and the plot is saved (desirable in most cases)
         """
         out_path = os.path.dirname(out_file)
-        if not os.path.exists(out_path):
-            os.makedirs(out_path)
+        os.makedirs(out_path, exist_ok=True)
 
         # Create a temporary file to use for the initial clipping
         _, temp_file = tempfile.mkstemp(suffix=os.path.splitext(out_file)[1])
         if not fill_plot:
-            clip_res = geoimage.clip_raster_intersection(file_source, file_bounds, clip_bounds, temp_file)
+            if __internal__.is_axis_aligned_rectangle(clip_bounds) and \
+                    __internal__.is_axis_aligned_rectangle(file_bounds):
+                clip_res = __internal__.clip_raster_rectangle(file_source, file_bounds, clip_bounds, temp_file)
+            else:
+                clip_res = geoimage.clip_raster_intersection(file_source, file_bounds, clip_bounds, temp_file)
         else:
             logging.info("Clipping image to plot boundary with fill")
             tuples = geometries.geometry_to_tuples(clip_bounds)
@@ -505,11 +829,67 @@ class __internal__:
             out_file: the path to save the clipped LAS data to
         """
         out_path = os.path.dirname(out_file)
-        if not os.path.exists(out_path):
-            os.makedirs(out_path)
+        os.makedirs(out_path, exist_ok=True)
 
         lasfile.clip_las(file_source, file_bounds, out_path=out_file)
 
+    @staticmethod
+    def clip_file_plots(filename: str, file_path: str, file_bounds_wkb: bytes, overlap_plots_wkb: dict,
+                        source_md: dict, working_folder: str, full_plot_fill: bool = False,
+                        timestamp: str = None) -> tuple:
+        """Clips a file to each of the plots that overlap it
+        Arguments:
+            filename: the name of the file to clip
+            file_path: the path to the file to clip
+            file_bounds_wkb: the WKB of the file's boundary
+            overlap_plots_wkb: dictionary of the overlapping plot names and the WKB of their boundaries, in the
+                    same coordinate system as the file
+            source_md: the cleaned up request metadata to copy into each plot's metadata (see cleanup_request_md)
+            working_folder: the folder to write the clipped files to, one sub-folder per plot
+            full_plot_fill: if set to True clipped images are filled to the plot boundaries (see clip_tiff)
+            timestamp: the ISO formatted timestamp to add to the file metadata (see prepare_container_md)
+        Return:
+            A tuple containing the list of container metadata for the clipped files, the list of plot folders
+            that may be empty, and the number of plots processed
+        Notes:
+            Geometries are passed as WKB so that this function can be run in a separate process
+        """
+        # pylint: disable=too-many-arguments
+        file_container_md = []
+        possible_empty_folders = []
+        processed_plots = 0
+
+        file_bounds = ogr.CreateGeometryFromWkb(file_bounds_wkb)
+        for plot_name in overlap_plots_wkb:
+            processed_plots += 1
+            plot_bounds = ogr.CreateGeometryFromWkb(overlap_plots_wkb[plot_name])
+            logging.debug("Clipping out plot '%s': %s", str(plot_name), str(plot_bounds))
+            if __internal__.calculate_overlap_percent(plot_bounds, file_bounds) < 0.10:
+                logging.info("Skipping plot with too small overlap: %s", plot_name)
+                continue
+
+            plot_md = dict(source_md)
+            plot_md['plot_name'] = plot_name
+
+            out_path = os.path.join(working_folder, plot_name)
+            out_file = os.path.join(out_path, filename)
+            if filename.endswith('.tif'):
+                # If file is a geoTIFF, simply clip it
+                __internal__.clip_tiff(file_path, file_bounds, plot_bounds, out_file, full_plot_fill)
+            elif filename.endswith('.las'):
+                tuples = geometries.geometry_to_tuples(plot_bounds)
+                __internal__.clip_las(file_path, tuples, out_file)
+            else:
+                continue
+
+            if os.path.exists(out_file):
+                file_container_md.append(__internal__.prepare_container_md(plot_name, plot_md, file_path, [out_file],
+                                                                           check_exists=False, timestamp=timestamp))
+            else:
+                possible_empty_folders.append(out_path)
+
+        return file_container_md, possible_empty_folders, processed_plots
+
 
 class PlotClip(algorithm.Algorithm):
     """Clips georeferenced files to plots"""
@@ -546,11 +926,13 @@ class PlotClip(algorithm.Algorithm):
         processed_files = 0
         processed_plots = 0
         start_timestamp = datetime.datetime.now()
+        run_timestamp = datetime.datetime.utcnow().isoformat()
         file_list = check_md.get_list_files()
         files_to_process = __internal__.get_files_to_process(file_list, environment.args.epsg)
         logging.info("Found %s files to process", str(len(files_to_process)))
 
         container_md = []
+        container_md_index = {}
         possible_empty_folders = []
         if files_to_process:
             # Get all the possible plots
@@ -558,50 +940,50 @@ class PlotClip(algorithm.Algorithm):
             all_plots = __internal__.load_plot_file(environment.args.plot_file, environment.args.plot_column)
             logging.debug("Loaded %s plots", str(len(all_plots)))
 
+            # Plot indexes are kept for each spatial reference we encounter
+            plots_indexes = {}
+            source_md = __internal__.cleanup_request_md(check_md)
+
+            # Find the plots overlapping each file. Geometries are passed as WKB so they can be sent to other processes
+            file_jobs = []
             for filename in files_to_process:
                 processed_files += 1
                 file_path = files_to_process[filename]['path']
                 file_bounds = files_to_process[filename]['bounds']
                 logging.debug("File bounds: %s", str(file_bounds))
 
-                overlap_plots = __internal__.find_plots_intersect_boundingbox(file_bounds, all_plots)
-                logging.info("Have %s plots intersecting file '%s'", str(len(overlap_plots)), filename)
-
                 file_spatial_ref = file_bounds.GetSpatialReference()
-                for plot_name in overlap_plots:
-                    processed_plots += 1
-                    plot_bounds = geometries.convert_geometry(overlap_plots[plot_name], file_spatial_ref)
-                    logging.debug("Clipping out plot '%s': %s", str(plot_name), str(plot_bounds))
-                    if __internal__.calculate_overlap_percent(plot_bounds, file_bounds) < 0.10:
-                        logging.info("Skipping plot with too small overlap: %s", plot_name)
-                        continue
-
-                    plot_md = __internal__.cleanup_request_md(check_md)
-                    plot_md['plot_name'] = plot_name
-
-                    if filename.endswith('.tif'):
-                        # If file is a geoTIFF, simply clip it
-                        out_path = os.path.join(check_md.working_folder, plot_name)
-                        out_file = os.path.join(out_path, filename)
-                        __internal__.clip_tiff(file_path, file_bounds, plot_bounds, out_file, environment.args.full_plot_fill)
-
-                        if os.path.exists(out_file):
-                            cur_md = __internal__.prepare_container_md(plot_name, plot_md, file_path, [out_file])
-                            container_md = __internal__.merge_container_md(container_md, cur_md)
-                        else:
-                            possible_empty_folders.append(out_path)
+                index_key = file_spatial_ref.ExportToWkt() if file_spatial_ref else ''
+                if index_key not in plots_indexes:
+                    plots_indexes[index_key] = __internal__.build_plots_index(all_plots, file_spatial_ref)
 
-                    elif filename.endswith('.las'):
-                        tuples = geometries.geometry_to_tuples(plot_bounds)
-                        out_path = os.path.join(check_md.working_folder, plot_name)
-                        out_file = os.path.join(out_path, filename)
-                        __internal__.clip_las(file_path, tuples, out_file)
+                overlap_plots = __internal__.find_plots_intersect_boundingbox(file_bounds, all_plots,
+                                                                              plots_indexes[index_key])
+                logging.info("Have %s plots intersecting file '%s'", str(len(overlap_plots)), filename)
 
-                        if os.path.exists(out_file):
-                            cur_md = __internal__.prepare_container_md(plot_name, plot_md, file_path, [out_file])
-                            container_md = __internal__.merge_container_md(container_md, cur_md)
-                        else:
-                            possible_empty_folders.append(out_path)
+                file_jobs.append((filename, file_path, bytes(file_bounds.ExportToWkb()),
+                                  {plot_name: bytes(overlap_plots[plot_name].ExportToWkb()) for plot_name in overlap_plots},
+                                  source_md, check_md.working_folder, environment.args.full_plot_fill,
+                                  run_timestamp))
+
+            # Clip the files, in parallel if there's more than one
+            if len(file_jobs) > 1:
+                if hasattr(os, 'sched_getaffinity'):
+                    available_cpus = len(os.sched_getaffinity(0))
+                else:
+                    available_cpus = os.cpu_count() or 1
+                max_workers = min(len(file_jobs), available_cpus)
+                logging.debug("Clipping %s files using %s processes", str(len(file_jobs)), str(max_workers))
+                with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    file_results = list(executor.map(__internal__.clip_file_plots, *zip(*file_jobs)))
+            else:
+                file_results = [__internal__.clip_file_plots(*one_job) for one_job in file_jobs]
+
+            for file_container_md, file_empty_folders, file_plot_count in file_results:
+                processed_plots += file_plot_count
+                for cur_md in file_container_md:
+                    container_md = __internal__.merge_container_md(container_md, cur_md, container_md_index)
+                possible_empty_folders.extend(file_empty_folders)
 
         # Check for possibly empty folders that should be cleaned up
         if not environment.args.keep_empty_folders and possible_empty_folders:
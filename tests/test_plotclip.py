@@ -162,3 +162,201 @@ def test_load_plot_file():
         assert 'Plot 2' in plot_keys
         for one_key in plot_keys:
             assert plots[one_key] is not None
+
+
+def test_find_plots_intersect_boundingbox():
+    """Tests finding the plots that intersect a bounding box"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+    from osgeo import ogr, osr
+
+    data_file_name = os.path.realpath(os.path.join(TESTING_JSON_FILE_PATH, 'plots.geojson'))
+    assert os.path.exists(data_file_name)
+    plots = pc.__internal__.load_plot_file(data_file_name)
+
+    bounds_sr = osr.SpatialReference()
+    bounds_sr.ImportFromEPSG(32612)
+    bounding_box = ogr.CreateGeometryFromWkt('POLYGON ((408989.0 3659976.0, 408989.9 3659976.0, 408989.9 3659972.0, '
+                                             '408989.0 3659972.0, 408989.0 3659976.0))')
+    bounding_box.AssignSpatialReference(bounds_sr)
+
+    res = pc.__internal__.find_plots_intersect_boundingbox(bounding_box, plots)
+    assert len(res) == 1
+    assert '1' in res
+
+    far_box = ogr.CreateGeometryFromWkt('POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))')
+    far_box.AssignSpatialReference(bounds_sr)
+    assert not pc.__internal__.find_plots_intersect_boundingbox(far_box, plots)
+
+
+def test_calculate_overlap_percent():
+    """Tests calculating the overlap of rectangular and non-rectangular boundaries"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+    from osgeo import ogr
+
+    file_bounds = ogr.CreateGeometryFromWkt('POLYGON ((0 10, 10 10, 10 0, 0 0, 0 10))')
+    tests = [
+        ('POLYGON ((2 4, 4 4, 4 2, 2 2, 2 4))', 1.0),
+        ('POLYGON ((8 4, 12 4, 12 2, 8 2, 8 4))', 0.5),
+        ('POLYGON ((20 4, 22 4, 22 2, 20 2, 20 4))', 0.0),
+        ('POLYGON ((8 2, 12 2, 12 6, 8 2))', 0.25),
+    ]
+    for wkt, expected in tests:
+        plot_bounds = ogr.CreateGeometryFromWkt(wkt)
+        assert pc.__internal__.calculate_overlap_percent(plot_bounds, file_bounds) == pytest.approx(expected)
+
+    assert pc.__internal__.is_axis_aligned_rectangle(file_bounds)
+    assert not pc.__internal__.is_axis_aligned_rectangle(ogr.CreateGeometryFromWkt('POLYGON ((0 0, 1 1, 1 0, 0 1, 0 0))'))
+
+
+def test_merge_container_md():
+    """Tests merging container metadata"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+
+    def make_md(plot_name: str, paths: list) -> dict:
+        """Returns container metadata for the plot and file paths"""
+        return {'name': plot_name, 'metadata': {'replace': True, 'data': {}},
+                'file': [{'path': one_path, 'metadata': {}} for one_path in paths]}
+
+    for md_index in [None, {}]:
+        res = pc.__internal__.merge_container_md([], make_md('plot1', ['a.tif']), md_index)
+        res = pc.__internal__.merge_container_md(res, make_md('plot2', ['a.tif']), md_index)
+        res = pc.__internal__.merge_container_md(res, make_md('plot1', ['a.tif', 'b.las']), md_index)
+        res = pc.__internal__.merge_container_md(res, make_md('plot2', ['a.tif']), md_index)
+
+        assert [one_md['name'] for one_md in res] == ['plot1', 'plot2']
+        assert [one_file['path'] for one_file in res[0]['file']] == ['a.tif', 'b.las']
+        assert [one_file['path'] for one_file in res[1]['file']] == ['a.tif']
+        if md_index is not None:
+            assert md_index == {'plot1': 0, 'plot2': 1}
+
+
+def test_get_files_to_process_skipped():
+    """Tests that missing and unsupported files are not processed"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+
+    file_list = [os.path.join(TESTING_JSON_FILE_PATH, 'plots.geojson'),
+                 os.path.join(TESTING_JSON_FILE_PATH, 'missing_file.tif'),
+                 os.path.join(TESTING_JSON_FILE_PATH, 'missing_folder', 'missing_file.las')]
+    assert not pc.__internal__.get_files_to_process(file_list)
+
+
+def test_convert_geometry():
+    """Tests that converting with a cached transformation matches geometries.convert_geometry()"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+    from agpypeline import geometries
+    from osgeo import ogr, osr
+
+    def make_polygon() -> ogr.Geometry:
+        """Returns a new EPSG:4326 polygon with its own spatial reference"""
+        polygon_sr = osr.SpatialReference()
+        polygon_sr.ImportFromEPSG(4326)
+        polygon = ogr.CreateGeometryFromWkt('POLYGON ((-111.975 33.075, -111.974 33.075, -111.974 33.074, '
+                                            '-111.975 33.074, -111.975 33.075))')
+        polygon.AssignSpatialReference(polygon_sr)
+        return polygon
+
+    target_sr = osr.SpatialReference()
+    target_sr.ImportFromEPSG(32612)
+
+    # Convert with the cached transformation first so that geometries.convert_geometry() can't change the source
+    res = pc.__internal__.convert_geometry(make_polygon(), target_sr)
+    expected = geometries.convert_geometry(make_polygon(), target_sr)
+
+    res_points = res.GetGeometryRef(0).GetPoints()
+    expected_points = expected.GetGeometryRef(0).GetPoints()
+    assert len(res_points) == len(expected_points)
+    for res_point, expected_point in zip(res_points, expected_points):
+        assert res_point[0] == pytest.approx(expected_point[0])
+        assert res_point[1] == pytest.approx(expected_point[1])
+    assert res.GetSpatialReference().IsSame(target_sr)
+
+
+def test_geojson_to_wkb():
+    """Tests packing GeoJSON geometries into WKB and falling back to OGR for unsupported geometries"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+    from osgeo import ogr
+
+    good_geometries = [
+        {'type': 'Point', 'coordinates': [1.5, 2]},
+        {'type': 'Point', 'coordinates': [1.5, 2, 3]},
+        {'type': 'LineString', 'coordinates': [[0, 0], [1, 1.5]]},
+        {'type': 'Polygon', 'coordinates': [[[0, 0, 1], [1, 0, 1], [1, 1, 2], [0, 0, 1]]]},
+        {'type': 'Polygon', 'coordinates': [[[0, 0], [4, 0], [4, 4], [0, 0]], [[1, 1], [2, 1], [2, 2], [1, 1]]]},
+        {'type': 'MultiPoint', 'coordinates': [[0, 0], [1, 1]]},
+        {'type': 'MultiLineString', 'coordinates': [[[0, 0, 1], [1, 1, 1]], [[2, 2, 2], [3, 3, 3]]]},
+        {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 0]]],
+                                                 [[[2, 2], [3, 2], [3, 3], [2, 2]]]]},
+    ]
+    for one_geometry in good_geometries:
+        wkb = pc.__internal__.geojson_to_wkb(one_geometry)
+        assert wkb is not None
+        res = ogr.CreateGeometryFromWkb(wkb)
+        expected = ogr.CreateGeometryFromJson(json.dumps(one_geometry))
+        assert res.GetGeometryType() == expected.GetGeometryType()
+        assert res.GetCoordinateDimension() == expected.GetCoordinateDimension()
+        assert res.ExportToWkt() == expected.ExportToWkt()
+
+    fallback_geometries = [
+        {'type': 'Polygon', 'coordinates': [[[0, 0, 1], [1, 0], [1, 1, 1], [0, 0, 1]]]},
+        {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]], [[0, 0, 1], [1, 1, 1], [0, 0, 1]]]},
+        {'type': 'Point', 'coordinates': [1, 2, 3, 4]},
+        {'type': 'LineString', 'coordinates': [[0, 0, 1, 2], [1, 1, 1, 2]]},
+        {'type': 'Polygon', 'coordinates': [[]]},
+        {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]], []]},
+        {'type': 'Point', 'coordinates': [1, None]},
+        {'type': 'Point', 'coordinates': [1, '1.5']},
+        {'type': 'Point', 'coordinates': [1, True]},
+        {'type': 'LineString', 'coordinates': [[0.5, 0], [1.5, True]]},
+        {'type': 'Point', 'coordinates': [10 ** 400, 1]},
+        {'type': 'GeometryCollection', 'geometries': [{'type': 'Point', 'coordinates': [1, 2]}]},
+    ]
+    for one_geometry in fallback_geometries:
+        assert pc.__internal__.geojson_to_wkb(one_geometry) is None
+
+
+def test_load_plot_file_json_fallback(tmp_path):
+    """Tests loading a JSON file with values that orjson doesn't accept"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+
+    data_file_name = os.path.realpath(os.path.join(TESTING_JSON_FILE_PATH, 'plots.geojson'))
+    with open(data_file_name, 'r') as in_file:
+        geojson = json.load(in_file)
+    geojson['height'] = float('nan')
+    geojson['big_number'] = 2 ** 70
+
+    json_file_name = str(tmp_path / 'json_fallback_plots.json')
+    with open(json_file_name, 'w') as out_file:
+        json.dump(geojson, out_file)
+    plots = pc.__internal__.load_plot_file(json_file_name)
+    assert len(plots) == 2
+    assert 1 in plots
+    assert 'Plot 2' in plots
+
+
+def test_clip_file_plots_no_overlap(tmp_path):
+    """Tests that plots without enough overlap with a file aren't clipped"""
+    # pylint: disable=import-outside-toplevel
+    import plotclip as pc
+    from osgeo import ogr
+
+    file_bounds = ogr.CreateGeometryFromWkt('POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))')
+    overlap_plots = {
+        'outside': ogr.CreateGeometryFromWkt('POLYGON ((20 20, 30 20, 30 30, 20 30, 20 20))'),
+        'small_overlap': ogr.CreateGeometryFromWkt('POLYGON ((9.5 0, 19.5 0, 19.5 10, 9.5 10, 9.5 0))')
+    }
+    working_folder = str(tmp_path / 'clip_file_plots_no_overlap')
+
+    res = pc.__internal__.clip_file_plots('missing_file.tif', os.path.join(working_folder, 'missing_file.tif'),
+                                          bytes(file_bounds.ExportToWkb()),
+                                          {plot_name: bytes(overlap_plots[plot_name].ExportToWkb())
+                                           for plot_name in overlap_plots},
+                                          {}, working_folder)
+    assert res == ([], [], 2)
+    assert not os.path.exists(working_folder)